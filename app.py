@@ -4,9 +4,9 @@
 # Date: 2025-01-11
 
 import time
-import threading
+import concurrent.futures
+import docker
 import numpy as np
-import pandas as pd
 import streamlit as st
 from code_editor import code_editor
 from llm_sandbox import SandboxSession
@@ -42,31 +42,53 @@ editor_buttons = [{
 code = lang_map[lang][2]
 response_dict = code_editor(code, lang=lang_map[lang][0], height=[15,15], options={"wrap": False}, buttons=editor_buttons)
 
+@st.cache_resource
+def _docker_client():
+    """Docker client shared by all runs, so each submission does not reconnect to the daemon."""
+    return docker.from_env()
+
+@st.cache_resource
+def _executor():
+    """Worker threads shared by all runs, so each submission does not start a new thread."""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
 def run_with_timeout(func, timeout, *args, **kwargs):
     """Runs a function with a timeout."""
-    desc = kwargs['desc']
+    desc = kwargs.pop('desc')
+    on_timeout = kwargs.pop('on_timeout', None)
     result = {'output': None, 'error': None}
     my_bar = st.progress(0, text=f"{desc} starts")
 
-    def target():
+    started = []
+    def task():
+        started.append(time.monotonic())
+        return func(*args, **kwargs)
+
+    future = _executor().submit(task)
+
+    # Time spent waiting for a free worker does not count against the timeout
+    while not started and not future.done():
+        concurrent.futures.wait([future], timeout=0.25)
+        my_bar.progress(0, text=f"{desc} Queued...")
+
+    # Wake up as soon as the task finishes; the 0.25s tick only drives the progress bar
+    start = started[0] if started else time.monotonic()
+    while (elapsed := time.monotonic() - start) < timeout:
+        done, _ = concurrent.futures.wait([future], timeout=min(0.25, timeout - elapsed))
+        if done:
+            break
+        my_bar.progress(elapsed / timeout, text=f"{desc} Running ({elapsed:.1f}/{timeout}) s...")
+
+    if future.done():
         try:
-            result['output'] = func(*args, **kwargs)
+            result['output'] = future.result()
         except Exception as e:
             result['error'] = e
-
-    thread = threading.Thread(target=target)
-    thread.start()
-    
-    for ts in range(timeout+1):
-        time.sleep(1)
-        if not thread.is_alive():
-            my_bar.progress(ts / timeout, text=f"{desc} Finished.")
-            break  # If the thread finishes, exit the loop
-        my_bar.progress(ts / timeout, text=f"{desc} Running ({ts}/{timeout}) s...")
-        ts += 1
-
-    if thread.is_alive():
-        thread.join(0)  # Clean up the thread
+        my_bar.progress(1.0, text=f"{desc} Finished.")
+    else:
+        future.cancel()
+        if on_timeout:
+            on_timeout()
         result["error"] = 'Timeout Reached.'
         my_bar.progress(1.0, text=f"{desc} Timeout reached.")
     return result
@@ -74,10 +96,12 @@ def run_with_timeout(func, timeout, *args, **kwargs):
 if response_dict['type'] == 'submit':
     code = response_dict['text']
     with st.spinner('Ok, give me a sec...'):
-        with SandboxSession(lang=lang_map[lang][1], verbose=True) as session:
+        with SandboxSession(client=_docker_client(), lang=lang_map[lang][1], verbose=True, reuse_container=True) as session:
+            response = {'output': None, 'error': None}
             if libs:
-                response = run_with_timeout(session.setup, 120, desc='Library Setup', libraries=libs)
-            response = run_with_timeout(session.run, 60, code, True, desc='Code Execution', )
+                response = run_with_timeout(session.setup, 120, desc='Library Setup', on_timeout=session.kill, libraries=libs)
+            if not response['error']:
+                response = run_with_timeout(session.run, 60, code, True, desc='Code Execution', on_timeout=session.kill)
     
     if response['output'] and response['output']['stdout']:
         st.success(response['output']['stdout'])
@@ -88,6 +112,7 @@ if response_dict['type'] == 'submit':
         st.error(response['output']['stderr'])
     else:
         st.write(f"**Execution Time:** :blue[{response['output']['duration']}] ms, **Peak Memory:** :blue[{response['output']['peak_memory']}] kb, **Integral:** :blue[{response['output']['integral']}] kb*ms")
-        st.area_chart(pd.DataFrame(response['output']['log'], columns=["timestemp", "memory"]), x='timestemp', y='memory')
+        log = np.asarray(response['output']['log'], dtype=np.int64).reshape(-1, 2)
+        st.area_chart({"timestemp": log[:, 0], "memory": log[:, 1]}, x='timestemp', y='memory')
 
    
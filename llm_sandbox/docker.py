@@ -1,8 +1,15 @@
 import io
 import os
+import re
+import time
+import shlex
+import atexit
 import docker
 import tarfile
-import tempfile
+import threading
+import numpy as np
+import importlib.resources
+from collections import deque
 from typing import List, Optional, Union
 
 from docker.models.images import Image
@@ -10,7 +17,7 @@ from docker.models.containers import Container
 from docker.types import Mount
 from llm_sandbox.utils import (
     image_exists,
-    get_libraries_installation_command,
+    get_libraries_installation_command_batch,
     get_code_file_extension,
     get_code_execution_command,
 )
@@ -22,6 +29,126 @@ from llm_sandbox.const import (
     NotSupportedLibraryInstallation,
 )
 
+# Shell script that samples the RSS of the profiled process, copied into the container on first use
+_PROFILER_BYTES: bytes = (
+    importlib.resources.files("llm_sandbox").joinpath("memory_profiler.sh").read_bytes()
+)
+
+# Where the code is written, run and profiled in the container, for languages that differ from the /tmp default
+_LANG_SPEC: dict[str, dict] = {
+    SupportedLanguage.GO: {
+        "code_dest": "/go_space/code.go",
+        "workdir": "/go_space",
+        "log_src": "/go_space/mem_usage.log",
+    },
+}
+
+# A complete "<timestamp_ns> <rss_kb>" line of the profiler log; a line cut off by a kill does not match
+_MEMORY_LOG_LINE = re.compile(rb"^(\d+) (\d+)$", re.MULTILINE)
+_MEMORY_LOG_DTYPE = np.dtype([("timestamp", np.int64), ("memory", np.int64)])
+
+# Image objects resolved by daemon URL and tag, shared across sessions to skip repeated daemon lookups
+_IMAGE_CACHE: dict[tuple[str, str], Image] = {}
+
+# Per-stream cap on the command output kept in memory by `execute_command`
+_MAX_OUTPUT_BYTES = 1024 * 1024
+
+
+def _decode_output(buffer: bytearray, total: int) -> Optional[str]:
+    if not buffer:
+        return None
+
+    text = buffer.decode("utf-8", errors="replace")
+    if total > len(buffer):
+        text += f"\n... [output truncated, {total - len(buffer)} more bytes]"
+    return text
+
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks, e.g. the stream returned by `get_archive`"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer.extend(chunk)
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+
+class _ContainerPool:
+    """Idle sandbox containers kept running between sessions, keyed by daemon, image and container settings"""
+
+    def __init__(self, idle_timeout: float = 300.0):
+        self.idle_timeout = idle_timeout
+        self._idle: dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def checkout(self, key: tuple) -> Optional[Container]:
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                container, _ = idle.pop()
+
+            # The container may have been stopped or removed while it sat in the pool
+            try:
+                container.reload()
+                if container.status == "running":
+                    return container
+            except docker.errors.APIError:
+                pass
+            self._remove([container])
+
+    def checkin(self, key: tuple, container: Container):
+        with self._lock:
+            self._idle.setdefault(key, deque()).append((container, time.monotonic()))
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._evict_idle, daemon=True)
+                self._reaper.start()
+
+    def drain(self):
+        with self._lock:
+            containers = [c for idle in self._idle.values() for c, _ in idle]
+            self._idle.clear()
+        self._remove(containers)
+
+    def _evict_idle(self):
+        while True:
+            time.sleep(self.idle_timeout)
+            cutoff = time.monotonic() - self.idle_timeout
+            expired = []
+            with self._lock:
+                for idle in self._idle.values():
+                    while idle and idle[0][1] <= cutoff:
+                        expired.append(idle.popleft()[0])
+            self._remove(expired)
+
+    @staticmethod
+    def _remove(containers: List[Container]):
+        for container in containers:
+            try:
+                container.remove(force=True)
+            except docker.errors.APIError:
+                pass
+
+
+_POOL = _ContainerPool()
+atexit.register(_POOL.drain)
+
 
 class SandboxDockerSession(Session):
     def __init__(
@@ -35,6 +162,7 @@ class SandboxDockerSession(Session):
         verbose: bool = False,
         mounts: Optional[list[Mount]] = None,
         container_configs: Optional[dict] = None,
+        reuse_container: bool = False,
     ):
         """
         Create a new sandbox session
@@ -47,6 +175,7 @@ class SandboxDockerSession(Session):
         :param verbose: if True, print messages
         :param mounts: List of mounts to be mounted to the container
         :param container_configs: Additional configurations for the container, i.e. resources limits (cpu_count, mem_limit), etc.
+        :param reuse_container: if True, the container is returned to a shared pool on close and reused by later sessions
         """
         super().__init__(lang, verbose)
         if image and dockerfile:
@@ -61,6 +190,11 @@ class SandboxDockerSession(Session):
             image = DefaultImage.__dict__[lang.upper()]
 
         self.lang: str = lang
+        self._spec: dict = _LANG_SPEC.get(lang) or {
+            "code_dest": f"/tmp/code.{get_code_file_extension(lang)}",
+            "workdir": None,
+            "log_src": "mem_usage.log",
+        }
         self.client: Optional[docker.DockerClient] = None
 
         if not client:
@@ -71,6 +205,8 @@ class SandboxDockerSession(Session):
         else:
             self.client = client
 
+        # Low-level API client, used for exec and archive calls on the container by id
+        self._api: docker.APIClient = self.client.api
         self.image: Union[Image, str] = image
         self.dockerfile: Optional[str] = dockerfile
         self.container: Optional[Container] = None
@@ -81,6 +217,11 @@ class SandboxDockerSession(Session):
         self.verbose = verbose
         self.mounts = mounts
         self.container_configs = container_configs
+        self.reuse_container = reuse_container
+        self._pool_key: Optional[tuple] = None
+        self._known_dirs: set[str] = {"/tmp"}
+        self._copied_files: set[str] = set()
+        self._has_time: bool = False
 
     def open(self):
         warning_str = (
@@ -101,51 +242,118 @@ class SandboxDockerSession(Session):
             )
             self.is_create_template = True
 
-        if isinstance(self.image, str):
-            if not image_exists(self.client, self.image):
-                if self.verbose:
-                    f_str = f"Pulling image {self.image}.."
-                    f_str = f"{f_str}\n{warning_str}" if self.keep_template else f_str
-                    print(f_str)
+        image_tag = self.image if isinstance(self.image, str) else None
+        if image_tag:
+            self.image = self._resolve_image(image_tag, warning_str)
 
-                self.image = self.client.images.pull(self.image)
-                self.is_create_template = True
-            else:
-                self.image = self.client.images.get(self.image)
-                if self.verbose:
-                    print(f"Using image {self.image.tags[-1]}")
+        # Images built from docker/Dockerfile.python ship GNU time already
+        self._has_time = isinstance(self.image, Image) and bool(
+            (self.image.labels or {}).get("sandbox.has_time")
+        )
+
+        if self.reuse_container:
+            self._pool_key = self._make_pool_key()
+            self.container = _POOL.checkout(self._pool_key)
+
+        if self.container:
+            # A pooled container has already been through setup()
+            self._has_time = True
+            if self.verbose:
+                print(f"Reusing container {self.container.short_id}")
+        else:
+            try:
+                self.container = self._start_container()
+            except docker.errors.ImageNotFound:
+                if not image_tag:
+                    raise
+                # The cached image may have been removed or re-tagged outside this process, so resolve the tag again
+                _IMAGE_CACHE.pop((self.client.api.base_url, image_tag), None)
+                self.image = self._resolve_image(image_tag, warning_str)
+                if self.reuse_container:
+                    self._pool_key = self._make_pool_key()
+                self.container = self._start_container()
+
+        self.setup()
+
+    def _resolve_image(self, image_tag: str, warning_str: str) -> Image:
+        cache_key = (self.client.api.base_url, image_tag)
+        if cache_key in _IMAGE_CACHE:
+            if self.verbose:
+                print(f"Using cached image {image_tag}")
+            return _IMAGE_CACHE[cache_key]
+
+        if not image_exists(self.client, image_tag):
+            if self.verbose:
+                f_str = f"Pulling image {image_tag}.."
+                f_str = f"{f_str}\n{warning_str}" if self.keep_template else f_str
+                print(f_str)
 
-        self.container = self.client.containers.run(
+            image = self.client.images.pull(image_tag)
+            self.is_create_template = True
+        else:
+            image = self.client.images.get(image_tag)
+            if self.verbose:
+                print(f"Using image {image.tags[-1]}")
+
+        _IMAGE_CACHE[cache_key] = image
+        return image
+
+    def _make_pool_key(self) -> tuple:
+        # Image ids are content hashes and repeat across daemons, so the daemon URL is part of the key
+        return (
+            self.client.api.base_url,
+            self.image.id if isinstance(self.image, Image) else self.image,
+            self.lang,
+            repr(self.mounts),
+            repr(self.container_configs),
+        )
+
+    def _start_container(self) -> Container:
+        # Without a TTY the image's default interactive command (e.g. the python REPL) would exit at once,
+        # so the container idles on `sleep` and all work goes through exec
+        return self.client.containers.run(
             self.image,
             detach=True,
-            tty=True,
+            tty=False,
+            stdin_open=False,
             mounts=self.mounts,
-            **self.container_configs if self.container_configs else {},
+            **{"command": "sleep infinity", **(self.container_configs or {})},
         )
-        
-        self.setup()
 
     def close(self):
         if self.container:
             if self.commit_container and isinstance(self.image, Image):
                 self.container.commit(self.image.tags[-1])
-
-            self.container.remove(force=True)
+                # The tag now points at the committed image, so later sessions must look it up again
+                self._evict_cached_image()
+
+            if self.reuse_container:
+                try:
+                    self.reset()
+                    _POOL.checkin(self._pool_key, self.container)
+                except docker.errors.APIError:
+                    # The container was killed or has exited, so it cannot go back to the pool
+                    self.container.remove(force=True)
+            else:
+                self.container.remove(force=True)
             self.container = None
+            self._known_dirs = {"/tmp"}
+            self._copied_files = set()
 
         if self.is_create_template and not self.keep_template:
-            # check if the image is used by any other container
-            containers = self.client.containers.list(all=True)
+            # check if the image is used by any other container, letting the daemon do the filtering
             image_id = (
                 self.image.id
                 if isinstance(self.image, Image)
                 else self.client.images.get(self.image).id
             )
-            image_in_use = any(
-                container.image.id == image_id for container in containers
+            image_in_use = bool(
+                self.client.containers.list(all=True, filters={"ancestor": image_id})
             )
 
             if not image_in_use:
+                self._evict_cached_image()
+
                 if isinstance(self.image, str):
                     self.client.images.remove(self.image)
                 elif isinstance(self.image, Image):
@@ -158,9 +366,47 @@ class SandboxDockerSession(Session):
                         f"Image {self.image.tags[-1]} is in use by other containers. Skipping removal.."
                     )
 
+    def kill(self):
+        """Kill the container so that a call blocked on it returns instead of running on"""
+        if not self.container:
+            return
+
+        try:
+            self.container.kill()
+        except docker.errors.APIError:
+            pass  # The container has already exited
+
+    def reset(self):
+        """
+        Return the open container to a clean state between runs, keeping the installed libraries
+        :raises docker.errors.APIError: if the container is no longer running
+        """
+        # Kill everything but the idle `sleep` at PID 1 so background processes from user code
+        # do not outlive the run, then drop the files it left behind
+        self._exec(
+            "sh -c 'for p in /proc/[0-9]*; do pid=${p#/proc/}; "
+            "[ \"$pid\" = 1 ] || [ \"$pid\" = $$ ] || kill -9 \"$pid\" 2>/dev/null; done; "
+            "rm -rf /tmp/code.* /tmp/memory_profiler.sh a.out mem_usage.log /go_space/*.go /go_space/mem_usage.log'"
+        )
+        self._copied_files = set()
+
+    def _evict_cached_image(self):
+        """Drop every cache entry of this daemon pointing at the session image"""
+        base_url = self.client.api.base_url
+        evicted = [
+            key for key, image in _IMAGE_CACHE.items()
+            if key[0] == base_url and image is self.image
+        ]
+        for key in evicted:
+            del _IMAGE_CACHE[key]
+
     def setup(self, libraries: Optional[List] = None):
-        self.execute_command('apt update')
-        self.execute_command('apt install time')
+        # Each exec is a round-trip to the Docker daemon, so chain commands into a single shell
+        if not self._has_time:
+            self.execute_command(
+                "sh -c 'apt-get update -qq && apt-get install -y -qq --no-install-recommends time'"
+            )
+            self._has_time = True
 
         if libraries:
             if self.lang.upper() in NotSupportedLibraryInstallation:
@@ -168,18 +414,17 @@ class SandboxDockerSession(Session):
                     f"Library installation has not been supported for {self.lang} yet!"
                 )
 
+            commands = [get_libraries_installation_command_batch(self.lang, libraries)]
             if self.lang == SupportedLanguage.GO:
-                self.execute_command("mkdir -p /go_space")
-                self.execute_command("go mod init go_space", workdir="/go_space")
-                self.execute_command("go mod tidy", workdir="/go_space")
+                commands = [
+                    "mkdir -p /go_space",
+                    "cd /go_space",
+                    "(test -f go.mod || go mod init go_space)",
+                    "go mod tidy",
+                ] + commands
+                self._known_dirs.add("/go_space")
 
-                for library in libraries:
-                    command = get_libraries_installation_command(self.lang, library)
-                    _ = self.execute_command(command, workdir="/go_space")
-            else:
-                for library in libraries:
-                    command = get_libraries_installation_command(self.lang, library)
-                    _ = self.execute_command(command)
+            self.execute_command(f"sh -c {shlex.quote(' && '.join(commands))}")
 
     def run(self, code: str, run_memory_profile: bool, *args, **kwargs) -> ConsoleOutput:
         if not self.container:
@@ -187,57 +432,51 @@ class SandboxDockerSession(Session):
                 "Session is not open. Please call open() method before running code."
             )
 
-        with tempfile.TemporaryDirectory() as directory_name:
-            code_file = os.path.join(directory_name, f"code.{get_code_file_extension(self.lang)}")
-            profiler_file = "/home/nus_cisco_wp1/Projects/llm-sandbox/memory_profiler.sh"
-            
-            if self.lang == SupportedLanguage.GO:
-                code_dest_file = "/go_space/code.go"
-            else:
-                code_dest_file = (
-                    f"/tmp/code.{get_code_file_extension(self.lang)}"  # code_file
-                )
-            profiler_dest_path = "/tmp/memory_profiler.sh"
-
-            with open(code_file, "w") as f:
-                f.write(code)
-
-            self.copy_to_runtime(code_file, code_dest_file)
-            if run_memory_profile:
-                self.copy_to_runtime(profiler_file, profiler_dest_path)
-
-            output = ConsoleOutput()
-            code_compiled= False
-            commands = get_code_execution_command(self.lang, code_dest_file, run_memory_profile=run_memory_profile)
-            
-            for index, command in enumerate(commands):
-                if self.lang == SupportedLanguage.GO:
-                    output = self.execute_command(command, workdir="/go_space")
-                else:
-                    output = self.execute_command(command)
-                    if self.verbose:
-                        print(output.stdout)
-                        print(output.stderr)
-                        
-            duration, peak_memory, integral, log = 0, 0, 0, list()
-            if run_memory_profile:
-                log_path = os.path.join(directory_name, 'mem_usage.log')
-                if self.lang == SupportedLanguage.GO:
-                    self.copy_from_runtime('/go_space/mem_usage.log', log_path)
-                else:
-                    self.copy_from_runtime('mem_usage.log', log_path)
-                
-                with open(log_path, "r") as mem_profile:
-                    for line in mem_profile.readlines():
-                        timestamp, mem = line.split(" ")
-                        peak_memory = max(peak_memory, int(mem))
-                        integral += peak_memory
-                        log.append((int(timestamp), int(mem)))
-                    duration = (log[-1][0] - log[0][0]) / 1000000
-                os.remove(log_path)
-                
-                
-            return {"stdout": output.stdout, "stderr": output.stderr, "peak_memory": peak_memory, "integral": integral, "duration": duration, 'log': log}
+        code_dest_file = self._spec["code_dest"]
+        profiler_dest_path = "/tmp/memory_profiler.sh"
+
+        self.copy_bytes_to_runtime(code.encode("utf-8"), code_dest_file)
+        if run_memory_profile and profiler_dest_path not in self._copied_files:
+            self.copy_bytes_to_runtime(_PROFILER_BYTES, profiler_dest_path, mode=0o755)
+            self._copied_files.add(profiler_dest_path)
+
+        commands = get_code_execution_command(self.lang, code_dest_file, run_memory_profile=run_memory_profile)
+
+        # A warm container still holds the build output and profiler log of the previous run, so drop them first,
+        # and chain the steps so a failed compile stops there and its error is what gets returned
+        script = " && ".join((f"rm -f a.out {self._spec['log_src']}", *commands))
+        output = self.execute_command(f"sh -c {shlex.quote(script)}", workdir=self._spec["workdir"])
+
+        duration, peak_memory, integral, log = 0, 0, 0, list()
+        if run_memory_profile:
+            try:
+                samples = self._load_memory_log(self._spec["log_src"])
+            except docker.errors.NotFound:
+                # The profiler never started because an earlier step failed
+                samples = np.empty((0, 2), dtype=np.int64)
+
+            if samples.size:
+                peak_memory = int(samples[:, 1].max())
+                integral = int(samples[:, 1].sum())
+                duration = (int(samples[-1, 0]) - int(samples[0, 0])) / 1000000
+                log = samples.tolist()
+
+        return {"stdout": output.stdout, "stderr": output.stderr, "peak_memory": peak_memory, "integral": integral, "duration": duration, 'log': log}
+
+    def _load_memory_log(self, src: str) -> np.ndarray:
+        """
+        Read the memory profiler log from the container archive stream and parse it in a single np.fromregex pass
+        :param src: Path of the log in the container, each line being "<timestamp_ns> <rss_kb>"
+        :return: Array of shape (n, 2) with the timestamps and memory samples
+        """
+        bits, stat = self._api.get_archive(self.container.id, src)
+        if stat["size"] == 0:
+            # The program exited before the profiler took its first sample
+            return np.empty((0, 2), dtype=np.int64)
+
+        with tarfile.open(fileobj=_ChunkReader(bits), mode="r|") as tar:
+            samples = np.fromregex(tar.extractfile(tar.next()), _MEMORY_LOG_LINE, dtype=_MEMORY_LOG_DTYPE)
+        return samples.view(np.int64).reshape(-1, 2)
 
     def copy_from_runtime(self, src: str, dest: str):
         if not self.container:
@@ -248,12 +487,12 @@ class SandboxDockerSession(Session):
         if self.verbose:
             print(f"Copying {self.container.short_id}:{src} to {dest}..")
 
-        bits, stat = self.container.get_archive(src)
+        bits, stat = self._api.get_archive(self.container.id, src)
         if stat["size"] == 0:
             raise FileNotFoundError(f"File {src} not found in the container")
 
-        tarstream = io.BytesIO(b"".join(bits))
-        with tarfile.open(fileobj=tarstream, mode="r") as tar:
+        # "r|" reads the archive as a forward-only stream, so it is never held in memory as a whole
+        with tarfile.open(fileobj=_ChunkReader(bits), mode="r|") as tar:
             tar.extractall(os.path.dirname(dest))
 
     def copy_to_runtime(self, src: str, dest: str):
@@ -262,15 +501,9 @@ class SandboxDockerSession(Session):
                 "Session is not open. Please call open() method before copying files."
             )
 
-        is_created_dir = False
-        directory = os.path.dirname(dest)
-        if directory and not self.container.exec_run(f"test -d {directory}")[0] == 0:
-            self.container.exec_run(f"mkdir -p {directory}")
-            is_created_dir = True
+        self._ensure_directory(os.path.dirname(dest))
 
         if self.verbose:
-            if is_created_dir:
-                print(f"Creating directory {self.container.short_id}:{directory}")
             print(f"Copying {src} to {self.container.short_id}:{dest}..")
 
         tarstream = io.BytesIO()
@@ -278,7 +511,52 @@ class SandboxDockerSession(Session):
             tar.add(src, arcname=os.path.basename(src))
 
         tarstream.seek(0)
-        self.container.put_archive(os.path.dirname(dest), tarstream)
+        self._api.put_archive(self.container.id, os.path.dirname(dest), tarstream)
+
+    def copy_bytes_to_runtime(self, data: bytes, dest: str, mode: int = 0o644):
+        """
+        Write in-memory content to a file in the container, without staging it on the host filesystem
+        :param data: File content
+        :param dest: Destination path in the container
+        :param mode: Permission bits of the created file
+        """
+        if not self.container:
+            raise RuntimeError(
+                "Session is not open. Please call open() method before copying files."
+            )
+
+        self._ensure_directory(os.path.dirname(dest))
+
+        if self.verbose:
+            print(f"Copying {len(data)} bytes to {self.container.short_id}:{dest}..")
+
+        info = tarfile.TarInfo(name=os.path.basename(dest))
+        info.size = len(data)
+        info.mode = mode
+        info.mtime = int(time.time())
+
+        tarstream = io.BytesIO()
+        with tarfile.open(fileobj=tarstream, mode="w") as tar:
+            tar.addfile(info, io.BytesIO(data))
+
+        tarstream.seek(0)
+        self._api.put_archive(self.container.id, os.path.dirname(dest), tarstream)
+
+    def _ensure_directory(self, directory: str):
+        if not directory or directory in self._known_dirs:
+            return
+
+        if not self._exec(f"test -d {directory}") == 0:
+            if self.verbose:
+                print(f"Creating directory {self.container.short_id}:{directory}")
+            self._exec(f"mkdir -p {directory}")
+        self._known_dirs.add(directory)
+
+    def _exec(self, command: str) -> int:
+        """Run a housekeeping command in the container, discarding its output, and return the exit code"""
+        exec_id = self._api.exec_create(self.container.id, command, tty=False)["Id"]
+        self._api.exec_start(exec_id)
+        return self._api.exec_inspect(exec_id)["ExitCode"]
 
     def execute_command(self, command: Optional[str], workdir: Optional[str] = None) -> ConsoleOutput:
         if not command:
@@ -292,13 +570,23 @@ class SandboxDockerSession(Session):
         if self.verbose:
             print(f"Executing command: {command}")
 
-        if workdir:
-            exit_code, exec_log = self.container.exec_run(command, stream=False, tty=False, workdir=workdir, demux=True)
-        else:
-            exit_code, exec_log = self.container.exec_run(command, stream=False, tty=False, demux=True)
-
-        stdout = exec_log[0].decode("utf-8") if exec_log[0] else None
-        stderr = exec_log[1].decode("utf-8") if exec_log[1] else None
+        exec_id = self._api.exec_create(self.container.id, command, tty=False, workdir=workdir)["Id"]
+
+        # Keep at most _MAX_OUTPUT_BYTES per stream, but drain the rest so the process is never blocked on write
+        buffers = (bytearray(), bytearray())
+        totals = [0, 0]
+        for chunks in self._api.exec_start(exec_id, stream=True, demux=True):
+            for i, chunk in enumerate(chunks):
+                if not chunk:
+                    continue
+                totals[i] += len(chunk)
+                room = _MAX_OUTPUT_BYTES - len(buffers[i])
+                if room > 0:
+                    buffers[i].extend(chunk[:room])
+
+        stdout, stderr = (
+            _decode_output(buffer, total) for buffer, total in zip(buffers, totals)
+        )
 
         if self.verbose:
             print(f"stdout:\n{stdout}")
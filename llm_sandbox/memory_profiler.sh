@@ -9,8 +9,9 @@ fi
 # Save commands as an array
 CMD=("$@")
 
-# Set log name
+# Set log name, starting from an empty log when the container runs code more than once
 LOG_FILE="mem_usage.log"
+: > "$LOG_FILE"
 
 # Get PID
 "${CMD[@]}" &
@@ -19,6 +19,7 @@ class SandboxSession:
         use_kubernetes: bool = False,
         kube_namespace: Optional[str] = "default",
         container_configs: Optional[dict] = None,
+        reuse_container: bool = False,
     ):
         """
         Create a new sandbox session
@@ -32,6 +33,7 @@ class SandboxSession:
         :param use_kubernetes: if True, use Kubernetes instead of Docker (default is False)
         :param kube_namespace: Kubernetes namespace to use (only if 'use_kubernetes' is True), default is 'default'
         :param container_configs: Additional configurations for the Docker container, i.e. resources limits (cpu_count, mem_limit), etc.
+        :param reuse_container: if True, Docker containers are pooled and reused across sessions instead of removed on close
         """
         if use_kubernetes:
             return SandboxKubernetesSession(
@@ -53,4 +55,5 @@ class SandboxSession:
             commit_container=commit_container,
             verbose=verbose,
             container_configs=container_configs,
+            reuse_container=reuse_container,
         )
@@ -1,11 +1,49 @@
+import io
 import re
+import functools
+import shlex
 import docker
 import docker.errors
-from typing import Optional
+from typing import List, Optional
 
 from docker import DockerClient
 from llm_sandbox.const import SupportedLanguage
 
+# Per-language command templates, formatted with the library name or the code file path
+_INSTALL_COMMANDS = {
+    SupportedLanguage.PYTHON: "pip install {}",
+    SupportedLanguage.JAVA: "mvn install:install-file -Dfile={}",
+    SupportedLanguage.JAVASCRIPT: "yarn add {}",
+    SupportedLanguage.CPP: "apt-get install {}",
+    SupportedLanguage.GO: "go get -u {}",
+    SupportedLanguage.RUBY: "gem install {}",
+}
+
+_FILE_EXTENSIONS = {
+    SupportedLanguage.PYTHON: "py",
+    SupportedLanguage.JAVA: "java",
+    SupportedLanguage.JAVASCRIPT: "js",
+    SupportedLanguage.CPP: "cpp",
+    SupportedLanguage.GO: "go",
+    SupportedLanguage.RUBY: "rb",
+}
+
+# Execution command templates keyed by (language, run_memory_profile)
+_EXECUTION_COMMANDS = {
+    (SupportedLanguage.PYTHON, False): ("python {}",),
+    (SupportedLanguage.PYTHON, True): ("/tmp/memory_profiler.sh python {}",),
+    (SupportedLanguage.JAVA, False): ("java {}",),
+    (SupportedLanguage.JAVA, True): ("/tmp/memory_profiler.sh java {}",),
+    (SupportedLanguage.JAVASCRIPT, False): ("node {}",),
+    (SupportedLanguage.JAVASCRIPT, True): ("/tmp/memory_profiler.sh node {}",),
+    (SupportedLanguage.CPP, False): ("g++ -o a.out {}", "./a.out"),
+    (SupportedLanguage.CPP, True): ("g++ -o a.out {}", "/tmp/memory_profiler.sh ./a.out"),
+    (SupportedLanguage.GO, False): ("go run {}",),
+    (SupportedLanguage.GO, True): ("/tmp/memory_profiler.sh go run {}",),
+    (SupportedLanguage.RUBY, False): ("ruby {}",),
+    (SupportedLanguage.RUBY, True): ("ruby {}",),
+}
+
 
 def image_exists(client: DockerClient, image: str) -> bool:
     """
@@ -15,12 +53,11 @@ def image_exists(client: DockerClient, image: str) -> bool:
     :return: True if the image exists, False otherwise
     """
     try:
-        client.images.get(image)
+        # A raw inspect is enough to tell whether the image exists, without building an Image model
+        client.api.inspect_image(image)
         return True
     except docker.errors.ImageNotFound:
         return False
-    except Exception as e:
-        raise e
 
 
 def get_libraries_installation_command(lang: str, library: str) -> Optional[str]:
@@ -30,20 +67,26 @@ def get_libraries_installation_command(lang: str, library: str) -> Optional[str]
     :param library: List of libraries
     :return: Installation command
     """
-    if lang == SupportedLanguage.PYTHON:
-        return f"pip install {library}"
-    elif lang == SupportedLanguage.JAVA:
-        return f"mvn install:install-file -Dfile={library}"
-    elif lang == SupportedLanguage.JAVASCRIPT:
-        return f"yarn add {library}"
-    elif lang == SupportedLanguage.CPP:
-        return f"apt-get install {library}"
-    elif lang == SupportedLanguage.GO:
-        return f"go get -u {library}"
-    elif lang == SupportedLanguage.RUBY:
-        return f"gem install {library}"
-    else:
-        raise ValueError(f"Language {lang} is not supported")
+    try:
+        return _INSTALL_COMMANDS[lang].format(library)
+    except KeyError:
+        raise ValueError(f"Language {lang} is not supported") from None
+
+
+def get_libraries_installation_command_batch(lang: str, libraries: List[str]) -> str:
+    """
+    Get a single shell command that installs all the given libraries for the given language
+    :param lang: Programming language
+    :param libraries: List of libraries
+    :return: Installation command
+    """
+    libraries = [shlex.quote(library) for library in libraries]
+    if lang == SupportedLanguage.GO:
+        # Each `go get` rewrites go.mod, so the libraries are fetched one after another
+        return " && ".join(
+            get_libraries_installation_command(lang, library) for library in libraries
+        )
+    return get_libraries_installation_command(lang, " ".join(libraries))
 
 
 def get_code_file_extension(lang: str) -> str:
@@ -52,60 +95,75 @@ def get_code_file_extension(lang: str) -> str:
     :param lang: Programming language
     :return: File extension
     """
-    if lang == SupportedLanguage.PYTHON:
-        return "py"
-    elif lang == SupportedLanguage.JAVA:
-        return "java"
-    elif lang == SupportedLanguage.JAVASCRIPT:
-        return "js"
-    elif lang == SupportedLanguage.CPP:
-        return "cpp"
-    elif lang == SupportedLanguage.GO:
-        return "go"
-    elif lang == SupportedLanguage.RUBY:
-        return "rb"
-    else:
-        raise ValueError(f"Language {lang} is not supported")
-
-
-def get_code_execution_command(lang: str, code_file: str, run_memory_profile: bool) -> list:
+    try:
+        return _FILE_EXTENSIONS[lang]
+    except KeyError:
+        raise ValueError(f"Language {lang} is not supported") from None
+
+
+@functools.lru_cache(maxsize=64)
+def get_code_execution_command(lang: str, code_file: str, run_memory_profile: bool) -> tuple:
     """
     Return the execution command for the given language and code file.
     :param lang: Language of the code
     :param code_file: Path to the code file
-    :return: List of execution commands
+    :return: Tuple of execution commands, shared between calls with the same arguments
     """
-    if run_memory_profile:
-        if lang == SupportedLanguage.PYTHON:
-            return [f"/tmp/memory_profiler.sh python {code_file}"]
-        elif lang == SupportedLanguage.JAVA:
-            return [f"/tmp/memory_profiler.sh java {code_file}"]
-        elif lang == SupportedLanguage.JAVASCRIPT:
-            return [f"/tmp/memory_profiler.sh node {code_file}"]
-        elif lang == SupportedLanguage.CPP:
-            return [f"g++ -o a.out {code_file}", "/tmp/memory_profiler.sh ./a.out"]
-        elif lang == SupportedLanguage.GO:
-            return [f"/tmp/memory_profiler.sh go run {code_file}"]
-        elif lang == SupportedLanguage.RUBY:
-            return [f"ruby {code_file}"]
-        else:
-            raise ValueError(f"Language {lang} is not supported")
-    else:
-        if lang == SupportedLanguage.PYTHON:
-            return [f"python {code_file}"]
-        elif lang == SupportedLanguage.JAVA:
-            return [f"java {code_file}"]
-        elif lang == SupportedLanguage.JAVASCRIPT:
-            return [f"node {code_file}"]
-        elif lang == SupportedLanguage.CPP:
-            return [f"g++ -o a.out {code_file}", "./a.out"]
-        elif lang == SupportedLanguage.GO:
-            return [f"go run {code_file}"]
-        elif lang == SupportedLanguage.RUBY:
-            return [f"ruby {code_file}"]
-        else:
-            raise ValueError(f"Language {lang} is not supported")
-    
+    try:
+        templates = _EXECUTION_COMMANDS[lang, bool(run_memory_profile)]
+    except KeyError:
+        raise ValueError(f"Language {lang} is not supported") from None
+    return tuple(template.format(code_file) for template in templates)
+
+
+# Header lines of `time -v` whose value needs more than an int conversion, one named group per field
+_TIME_V_HEADER_PATTERN = re.compile(
+    r'^(?:Command being timed: "(?P<command>.*)"'
+    r'|User time \(seconds\): (?P<user_time>[\d.]+)'
+    r'|System time \(seconds\): (?P<system_time>[\d.]+)'
+    r'|Percent of CPU this job got: (?P<cpu_percent>\d+)%'
+    r'|Elapsed \(wall clock\) time \(h:mm:ss or m:ss\): (?P<elapsed_time_seconds>.*))'
+)
+
+# Labels of the `time -v` lines holding a plain integer, mapped to their key in the parsed stats
+_TIME_V_FIELDS = {
+    "Maximum resident set size (kbytes)": "max_resident_set_kb",
+    "Average shared text size (kbytes)": "avg_shared_text_kb",
+    "Average unshared data size (kbytes)": "avg_unshared_data_kb",
+    "Average stack size (kbytes)": "avg_stack_size_kb",
+    "Average total size (kbytes)": "avg_total_size_kb",
+    "Minor (reclaiming a frame) page faults": "minor_page_faults",
+    "Major (requiring I/O) page faults": "major_page_faults",
+    "Voluntary context switches": "voluntary_context_switches",
+    "Involuntary context switches": "involuntary_context_switches",
+    "Swaps": "swaps",
+    "File system inputs": "file_system_inputs",
+    "File system outputs": "file_system_outputs",
+    "Signals delivered": "signals_delivered",
+    "Socket messages sent": "socket_messages_sent",
+    "Socket messages received": "socket_messages_received",
+    "Page size (bytes)": "page_size_bytes",
+    "Exit status": "exit_status",
+}
+
+
+def _parse_h_m_s(time_str: str) -> float:
+    """
+    Convert a time string of the form H:MM:SS or M:SS, as printed by `time -v`, into a total number of seconds as float.
+    """
+    parts = time_str.split(':')
+    seconds = float(parts[-1]) + int(parts[-2]) * 60
+    return seconds + int(parts[-3]) * 3600 if len(parts) == 3 else seconds
+
+
+# Converters for the values captured by _TIME_V_HEADER_PATTERN, keyed by group name
+_TIME_V_HEADER_PARSERS = {
+    "command": str,
+    "user_time": float,
+    "system_time": float,
+    "cpu_percent": int,
+    "elapsed_time_seconds": _parse_h_m_s,
+}
 
 
 def parse_time_v_output(time_v_text: str) -> dict:
@@ -120,103 +178,24 @@ def parse_time_v_output(time_v_text: str) -> dict:
         print(stats)
     """
     stats = {}
-    
-    # Regex patterns to capture various fields
-    cmd_pattern          = re.compile(r'^Command being timed: "(.*)"')
-    user_time_pattern    = re.compile(r'^User time \(seconds\): ([\d.]+)')
-    system_time_pattern  = re.compile(r'^System time \(seconds\): ([\d.]+)')
-    cpu_percent_pattern  = re.compile(r'^Percent of CPU this job got: (\d+)%')
-    elapsed_time_pattern = re.compile(r'^Elapsed \(wall clock\) time \(h:mm:ss or m:ss\): (.*)')
-    
-    # Helper function to parse the "h:mm:ss" or "m:ss" style time
-    def parse_h_m_s(time_str: str) -> float:
-        """
-        Convert a time string of the form H:MM:SS or M:SS or S into a total number of seconds as float.
-        """
-        parts = time_str.split(':')
-        if len(parts) == 3:
-            # hours:minutes:seconds
-            hours = int(parts[0])
-            minutes = int(parts[1])
-            seconds = float(parts[2])
-            return hours * 3600 + minutes * 60 + seconds
-        elif len(parts) == 2:
-            # minutes:seconds
-            minutes = int(parts[0])
-            seconds = float(parts[1])
-            return minutes * 60 + seconds
-        else:
-            # just seconds
-            return float(time_str)
-    
-    # Go line by line, match against known patterns, or do simple splits:
-    for line in time_v_text.splitlines():
+
+    # `time -v` reports after the program's own stderr, so skip straight to its header (or bail out without one)
+    start = time_v_text.rfind("Command being timed:")
+    if start == -1:
+        return stats
+
+    # Go line by line, look the label up in the known fields, or match against known patterns:
+    for line in io.StringIO(time_v_text[start:]):
         line = line.strip()
-        
-        # Check regex-based lines first
-        if match := cmd_pattern.match(line):
-            stats["command"] = match.group(1)
-        elif match := user_time_pattern.match(line):
-            stats["user_time"] = float(match.group(1))
-        elif match := system_time_pattern.match(line):
-            stats["system_time"] = float(match.group(1))
-        elif match := cpu_percent_pattern.match(line):
-            stats["cpu_percent"] = int(match.group(1))
-        elif match := elapsed_time_pattern.match(line):
-            raw_elapsed = match.group(1)
-            stats["elapsed_time_seconds"] = parse_h_m_s(raw_elapsed)
-            
-        # Simple split-based matches (key: value)
-        elif "Maximum resident set size (kbytes):" in line:
-            _, val = line.split(":", 1)
-            stats["max_resident_set_kb"] = int(val.strip())
-        elif "Average shared text size (kbytes):" in line:
-            _, val = line.split(":", 1)
-            stats["avg_shared_text_kb"] = int(val.strip())
-        elif "Average unshared data size (kbytes):" in line:
-            _, val = line.split(":", 1)
-            stats["avg_unshared_data_kb"] = int(val.strip())
-        elif "Average stack size (kbytes):" in line:
-            _, val = line.split(":", 1)
-            stats["avg_stack_size_kb"] = int(val.strip())
-        elif "Average total size (kbytes):" in line:
-            _, val = line.split(":", 1)
-            stats["avg_total_size_kb"] = int(val.strip())
-        elif "Minor (reclaiming a frame) page faults:" in line:
-            _, val = line.split(":", 1)
-            stats["minor_page_faults"] = int(val.strip())
-        elif "Major (requiring I/O) page faults:" in line:
-            _, val = line.split(":", 1)
-            stats["major_page_faults"] = int(val.strip())
-        elif "Voluntary context switches:" in line:
-            _, val = line.split(":", 1)
-            stats["voluntary_context_switches"] = int(val.strip())
-        elif "Involuntary context switches:" in line:
-            _, val = line.split(":", 1)
-            stats["involuntary_context_switches"] = int(val.strip())
-        elif "Swaps:" in line:
-            _, val = line.split(":", 1)
-            stats["swaps"] = int(val.strip())
-        elif "File system inputs:" in line:
-            _, val = line.split(":", 1)
-            stats["file_system_inputs"] = int(val.strip())
-        elif "File system outputs:" in line:
-            _, val = line.split(":", 1)
-            stats["file_system_outputs"] = int(val.strip())
-        elif "Signals delivered:" in line:
-            _, val = line.split(":", 1)
-            stats["signals_delivered"] = int(val.strip())
-        elif "Socket messages sent:" in line:
-            _, val = line.split(":", 1)
-            stats["socket_messages_sent"] = int(val.strip())
-        elif "Socket messages received:" in line:
-            _, val = line.split(":", 1)
-            stats["socket_messages_received"] = int(val.strip())
-        elif "Page size (bytes):" in line:
-            _, val = line.split(":", 1)
-            stats["page_size_bytes"] = int(val.strip())
-        elif "Exit status:" in line:
-            _, val = line.split(":", 1)
-            stats["exit_status"] = int(val.strip())
-
-    return stats
\ No newline at end of file
+
+        # Simple "label: integer" lines, resolved with one dict lookup on the label
+        label, _, value = line.partition(":")
+        if field := _TIME_V_FIELDS.get(label):
+            stats[field] = int(value)
+
+        # Header lines, matched by a single pattern and dispatched on the group that matched
+        elif match := _TIME_V_HEADER_PATTERN.match(line):
+            field = match.lastgroup
+            stats[field] = _TIME_V_HEADER_PARSERS[field](match.group(field))
+
+    return stats
@@ -6,37 +6,109 @@
 import sys
 sys.path.append('/home/nus_cisco_wp1/Projects/llm-sandbox')
 
+import asyncio
 import threading
+import concurrent.futures
+from collections import OrderedDict
+import docker
+import docker.errors
 from typing import Union
 from fastapi import FastAPI
 from llm_sandbox import SandboxSession
 
 app = FastAPI()
 
-def run_with_timeout(func, timeout, *args, **kwargs):
-    """Runs a function with a timeout."""
+# One Docker client for the whole app, instead of a new connection and version negotiation per request
+client = docker.from_env()
+
+# Threads that run the blocking sandbox calls, sized for the number of /run requests served at once
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
+# Open sessions with their libraries already installed, keyed by (lang, libraries), least recently used first
+MAX_WARM_SESSIONS = 8
+warm_sessions = OrderedDict()
+warm_sessions_lock = threading.Lock()
+
+async def run_with_timeout(session, timeout, *args, **kwargs):
+    """Runs the code in the session with a timeout, killing the sandbox container once it is reached."""
     result = {'output': None, 'error': None}
+    loop = asyncio.get_running_loop()
 
-    def target():
-        try:
-            result['output'] = func(*args, **kwargs)
-        except Exception as e:
-            result['error'] = e
+    started = loop.create_future()
 
-    thread = threading.Thread(target=target, daemon=True)
-    thread.start()
-    thread.join(timeout)
+    def task():
+        loop.call_soon_threadsafe(started.set_result, None)
+        return session.run(*args, **kwargs)
 
-    if thread.is_alive():
-        thread.join(0)  # Clean up the thread
+    future = loop.run_in_executor(executor, task)
+    try:
+        # Time spent waiting for a free worker does not count against the timeout
+        await started
+        result['output'] = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        # Not on `executor`: its workers may all be stuck in runs that only this kill can end
+        await loop.run_in_executor(None, session.kill)
         result["error"] = 'Timeout Reached.'
+    except Exception as e:
+        result['error'] = e
     return result
 
+def checkout_session(key):
+    """Takes a warm session for (lang, libraries), or opens a new one and installs the libraries."""
+    with warm_sessions_lock:
+        session = warm_sessions.pop(key, None)
+    if session is None:
+        lang, libraries = key
+        session = SandboxSession(client=client, lang=lang, verbose=True, reuse_container=True)
+        try:
+            session.open()
+            session.setup(libraries=list(libraries))
+        except Exception:
+            # e.g. the language does not support library installation; the container must not leak
+            session.close()
+            raise
+    return session
+
+def checkin_session(key, session):
+    """Keeps the session warm for the next request with the same key, closing the least recently used one past the cap."""
+    try:
+        # Background processes and files left by this request must not leak into the next one
+        session.reset()
+    except docker.errors.APIError:
+        session.close()
+        return
+    with warm_sessions_lock:
+        if key in warm_sessions:
+            evicted = session
+        else:
+            warm_sessions[key] = session
+            evicted = warm_sessions.popitem(last=False)[1] if len(warm_sessions) > MAX_WARM_SESSIONS else None
+    if evicted:
+        evicted.close()
+
+@app.on_event("shutdown")
+def close_warm_sessions():
+    with warm_sessions_lock:
+        sessions = list(warm_sessions.values())
+        warm_sessions.clear()
+    for session in sessions:
+        session.close()
+
 @app.get("/run")
-def execute(lang: str, code: str, libs: Union[str, None] = None):
-    with SandboxSession(lang=lang, verbose=True) as session:
-        session.setup(libraries=libs)
-        response = run_with_timeout(session.run, 60, code=code, run_memory_profile=True)
-    if response['output']['stderr']:
+async def execute(lang: str, code: str, libs: Union[str, None] = None):
+    libraries = tuple(sorted({lib.strip() for lib in libs.split(",")} - {""})) if libs else ()
+    key = (lang, libraries)
+
+    # Docker calls block, so they run on the executor to keep the event loop free
+    loop = asyncio.get_running_loop()
+    session = await loop.run_in_executor(executor, checkout_session, key)
+    response = await run_with_timeout(session, 60, code=code, run_memory_profile=True)
+    if response['error']:
+        # The container may have been killed or left in an unknown state, so only clean runs go back warm
+        await loop.run_in_executor(executor, session.close)
+    else:
+        await loop.run_in_executor(executor, checkin_session, key, session)
+
+    if response['output'] and response['output']['stderr']:
         response['error'] = "failed"
-    return {"lang": lang, "code": code, "libs": libs, "status": response}
\ No newline at end of file
+    return {"lang": lang, "code": code, "libs": libs, "status": response}
@@ -1,9 +1,12 @@
 import os
 import tarfile
+import docker
 import unittest
 from io import BytesIO
 from unittest.mock import patch, MagicMock
 from llm_sandbox import SandboxSession
+from docker.models.images import Image
+from llm_sandbox.docker import _IMAGE_CACHE, _POOL
 
 
 class TestSandboxSession(unittest.TestCase):
@@ -44,6 +47,37 @@ class TestSandboxSession(unittest.TestCase):
         self.mock_docker_client.containers.run.assert_called_once()
         self.assertIsNotNone(self.session.container)
 
+    def test_open_evicts_stale_cached_image(self):
+        stale_image, fresh_image = MagicMock(tags=[self.image]), MagicMock(tags=[self.image])
+        _IMAGE_CACHE[(self.mock_docker_client.api.base_url, self.image)] = stale_image
+        self.mock_docker_client.images.get.return_value = fresh_image
+        self.mock_docker_client.containers.run.side_effect = [
+            docker.errors.ImageNotFound("removed"),
+            MagicMock(),
+        ]
+
+        self.session.open()
+        self.assertIs(self.session.image, fresh_image)
+        self.assertIs(
+            _IMAGE_CACHE[(self.mock_docker_client.api.base_url, self.image)], fresh_image
+        )
+        self.assertEqual(self.mock_docker_client.containers.run.call_count, 2)
+
+    def test_open_does_not_retry_other_api_errors(self):
+        self.mock_docker_client.images.get.return_value = MagicMock(tags=[self.image])
+        self.mock_docker_client.containers.run.side_effect = docker.errors.APIError("port in use")
+
+        with self.assertRaises(docker.errors.APIError):
+            self.session.open()
+        self.mock_docker_client.containers.run.assert_called_once()
+
+    def test_pool_key_includes_daemon(self):
+        self.session.image = MagicMock(spec=Image, id="sha256:abc")
+        other = SandboxSession(client=MagicMock(), image=self.image, lang=self.lang)
+        other.image = self.session.image
+
+        self.assertNotEqual(self.session._make_pool_key(), other._make_pool_key())
+
     def test_close(self):
         mock_container = MagicMock()
         self.session.container = mock_container
@@ -53,6 +87,47 @@ class TestSandboxSession(unittest.TestCase):
         mock_container.remove.assert_called_once()
         self.assertIsNone(self.session.container)
 
+    def test_close_with_reuse_container(self):
+        self.session.reuse_container = True
+        self.session._pool_key = ("pool-test",)
+        mock_container = MagicMock(status="running")
+        self.session.container = mock_container
+
+        self.session.close()
+        mock_container.remove.assert_not_called()
+        command = self.mock_docker_client.api.exec_create.call_args[0][1]
+        self.assertIn("kill -9", command)
+        self.assertIsNone(self.session.container)
+        self.assertIs(_POOL.checkout(("pool-test",)), mock_container)
+        self.assertIsNone(_POOL.checkout(("pool-test",)))
+
+    def test_kill_ignores_exited_container(self):
+        self.session.container = MagicMock()
+        self.session.container.kill.side_effect = docker.errors.APIError("not running")
+
+        self.session.kill()
+        self.session.container.kill.assert_called_once()
+
+    def test_reset(self):
+        self.session.container = MagicMock()
+        self.session._copied_files = {"/tmp/memory_profiler.sh"}
+
+        self.session.reset()
+        command = self.mock_docker_client.api.exec_create.call_args[0][1]
+        self.assertIn("kill -9", command)
+        self.assertIn("/tmp/memory_profiler.sh", command)
+        self.assertEqual(self.session._copied_files, set())
+        self.assertIsNotNone(self.session.container)
+
+    def test_pool_checkout_skips_stopped_container(self):
+        stopped, running = MagicMock(status="exited"), MagicMock(status="running")
+        _POOL.checkin(("pool-stopped",), running)
+        _POOL.checkin(("pool-stopped",), stopped)
+
+        self.assertIs(_POOL.checkout(("pool-stopped",)), running)
+        stopped.remove.assert_called_once_with(force=True)
+        self.assertIsNone(_POOL.checkout(("pool-stopped",)))
+
     def test_run_without_open(self):
         with self.assertRaises(RuntimeError):
             self.session.run("print('Hello')")
@@ -65,6 +140,19 @@ class TestSandboxSession(unittest.TestCase):
         self.session.execute_command.assert_called()
         self.assertEqual(result, (0, "Output"))
 
+    def test_run_chains_commands_after_cleanup(self):
+        self.session.container = MagicMock()
+        self.session.execute_command = MagicMock(return_value=MagicMock(stdout="", stderr="error"))
+        self.mock_docker_client.api.get_archive.side_effect = docker.errors.NotFound("missing")
+
+        result = self.session.run("print('Hello')", True)
+        self.session.execute_command.assert_called_once_with(
+            "sh -c 'rm -f a.out mem_usage.log && /tmp/memory_profiler.sh python /tmp/code.py'",
+            workdir=None,
+        )
+        self.assertEqual(result["stderr"], "error")
+        self.assertEqual(result["log"], [])
+
     def test_copy_to_runtime(self):
         self.session.container = MagicMock()
         src = "test.txt"
@@ -73,10 +161,39 @@ class TestSandboxSession(unittest.TestCase):
             f.write("test content")
 
         self.session.copy_to_runtime(src, dest)
-        self.session.container.put_archive.assert_called()
+        self.mock_docker_client.api.put_archive.assert_called()
+
+        os.remove(src)
+
+    def test_copy_to_runtime_caches_directory_probe(self):
+        self.session.container = MagicMock()
+        mock_api = self.mock_docker_client.api
+        mock_api.exec_create.return_value = {"Id": "exec-id"}
+        mock_api.exec_inspect.return_value = {"ExitCode": 1}
+        src = "test.txt"
+        dest = "/workspace/test.txt"
+        with open(src, "w") as f:
+            f.write("test content")
+
+        self.session.copy_to_runtime(src, dest)
+        self.session.copy_to_runtime(src, dest)
+        self.assertEqual(mock_api.exec_create.call_count, 2)
+        mock_api.exec_create.assert_called_with(
+            self.session.container.id, "mkdir -p /workspace", tty=False
+        )
+        self.assertIn("/workspace", self.session._known_dirs)
 
         os.remove(src)
 
+    def test_copy_bytes_to_runtime(self):
+        self.session.container = MagicMock()
+
+        self.session.copy_bytes_to_runtime(b"print('Hello')", "/tmp/code.py")
+        _, path, tarstream = self.mock_docker_client.api.put_archive.call_args[0]
+        self.assertEqual(path, "/tmp")
+        with tarfile.open(fileobj=tarstream, mode="r") as tar:
+            self.assertEqual(tar.extractfile("code.py").read(), b"print('Hello')")
+
     @patch("tarfile.open")
     def test_copy_from_runtime(self, mock_tarfile_open):
         self.session.container = MagicMock()
@@ -91,7 +208,7 @@ class TestSandboxSession(unittest.TestCase):
             tar.addfile(tarinfo, BytesIO(b"test content"))
 
         tarstream.seek(0)
-        self.session.container.get_archive.return_value = (
+        self.mock_docker_client.api.get_archive.return_value = (
             [tarstream.read()],
             {"size": tarstream.__sizeof__()},
         )
@@ -109,16 +226,61 @@ class TestSandboxSession(unittest.TestCase):
 
         os.remove(dest)
 
+    def test_load_memory_log(self):
+        self.session.container = MagicMock()
+
+        log = b"1000000 512\n3000000 2048\n4000000"
+        tarstream = BytesIO()
+        with tarfile.open(fileobj=tarstream, mode="w") as tar:
+            tarinfo = tarfile.TarInfo(name="mem_usage.log")
+            tarinfo.size = len(log)
+            tar.addfile(tarinfo, BytesIO(log))
+
+        self.mock_docker_client.api.get_archive.return_value = (
+            [tarstream.getvalue()],
+            {"size": len(log)},
+        )
+
+        samples = self.session._load_memory_log("mem_usage.log")
+        self.assertEqual(samples.tolist(), [[1000000, 512], [3000000, 2048]])
+
+    def test_load_memory_log_empty(self):
+        self.session.container = MagicMock()
+        self.mock_docker_client.api.get_archive.return_value = (iter([]), {"size": 0})
+
+        samples = self.session._load_memory_log("mem_usage.log")
+        self.assertEqual(samples.shape, (0, 2))
+
     def test_execute_command(self):
         mock_container = MagicMock()
         self.session.container = mock_container
 
         command = "echo 'Hello'"
-        mock_container.exec_run.return_value = (0, iter([b"Hello\n"]))
+        mock_api = self.mock_docker_client.api
+        mock_api.exec_create.return_value = {"Id": "exec-id"}
+        mock_api.exec_start.return_value = iter([(b"Hello\n", None)])
 
         output = self.session.execute_command(command)
-        mock_container.exec_run.assert_called_with(command, stream=True, tty=True)
-        self.assertEqual(output.text, "Hello\n")
+        mock_api.exec_create.assert_called_with(
+            mock_container.id, command, tty=False, workdir=None
+        )
+        mock_api.exec_start.assert_called_with("exec-id", stream=True, demux=True)
+        self.assertEqual(output.stdout, "Hello\n")
+        self.assertIsNone(output.stderr)
+
+    @patch("llm_sandbox.docker._MAX_OUTPUT_BYTES", 4)
+    def test_execute_command_truncates_output(self):
+        mock_container = MagicMock()
+        self.session.container = mock_container
+
+        mock_api = self.mock_docker_client.api
+        mock_api.exec_create.return_value = {"Id": "exec-id"}
+        mock_api.exec_start.return_value = iter([(b"abc", None), (b"def", b"err")])
+
+        output = self.session.execute_command("yes")
+        self.assertTrue(output.stdout.startswith("abcd\n"))
+        self.assertIn("2 more bytes", output.stdout)
+        self.assertEqual(output.stderr, "err")
 
     def test_execute_empty_command(self):
         with self.assertRaises(ValueError):
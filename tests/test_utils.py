@@ -0,0 +1,132 @@
+import unittest
+import docker.errors
+from unittest.mock import MagicMock
+from llm_sandbox.const import SupportedLanguage
+from llm_sandbox.utils import (
+    get_code_execution_command,
+    get_code_file_extension,
+    get_libraries_installation_command_batch,
+    parse_time_v_output,
+    image_exists,
+)
+
+TIME_V_OUTPUT = """\
+\tCommand being timed: "python /tmp/code.py"
+\tUser time (seconds): 0.01
+\tSystem time (seconds): 0.02
+\tPercent of CPU this job got: 93%
+\tElapsed (wall clock) time (h:mm:ss or m:ss): 1:02.50
+\tAverage shared text size (kbytes): 0
+\tAverage unshared data size (kbytes): 0
+\tAverage stack size (kbytes): 0
+\tAverage total size (kbytes): 0
+\tMaximum resident set size (kbytes): 9216
+\tAverage resident set size (kbytes): 0
+\tMajor (requiring I/O) page faults: 3
+\tMinor (reclaiming a frame) page faults: 1049
+\tVoluntary context switches: 1
+\tInvoluntary context switches: 2
+\tSwaps: 0
+\tFile system inputs: 8
+\tFile system outputs: 16
+\tSocket messages sent: 0
+\tSocket messages received: 0
+\tSignals delivered: 0
+\tPage size (bytes): 4096
+\tExit status: 0
+"""
+
+
+class TestUtils(unittest.TestCase):
+    def test_libraries_installation_command_batch(self):
+        self.assertEqual(
+            get_libraries_installation_command_batch(
+                SupportedLanguage.PYTHON, ["numpy", "pandas>=2"]
+            ),
+            "pip install numpy 'pandas>=2'",
+        )
+
+    def test_libraries_installation_command_batch_go(self):
+        self.assertEqual(
+            get_libraries_installation_command_batch(
+                SupportedLanguage.GO, ["github.com/a/b", "github.com/c/d"]
+            ),
+            "go get -u github.com/a/b && go get -u github.com/c/d",
+        )
+
+    def test_code_file_extension(self):
+        self.assertEqual(get_code_file_extension(SupportedLanguage.RUBY), "rb")
+        with self.assertRaises(ValueError):
+            get_code_file_extension("cobol")
+
+    def test_code_execution_command(self):
+        self.assertEqual(
+            list(get_code_execution_command(SupportedLanguage.CPP, "/tmp/code.cpp", False)),
+            ["g++ -o a.out /tmp/code.cpp", "./a.out"],
+        )
+        self.assertEqual(
+            list(get_code_execution_command(SupportedLanguage.CPP, "/tmp/code.cpp", True)),
+            ["g++ -o a.out /tmp/code.cpp", "/tmp/memory_profiler.sh ./a.out"],
+        )
+        with self.assertRaises(ValueError):
+            get_code_execution_command("cobol", "/tmp/code.cob", False)
+
+    def test_parse_time_v_output(self):
+        self.assertEqual(
+            parse_time_v_output(TIME_V_OUTPUT),
+            {
+                "command": "python /tmp/code.py",
+                "user_time": 0.01,
+                "system_time": 0.02,
+                "cpu_percent": 93,
+                "elapsed_time_seconds": 62.5,
+                "avg_shared_text_kb": 0,
+                "avg_unshared_data_kb": 0,
+                "avg_stack_size_kb": 0,
+                "avg_total_size_kb": 0,
+                "max_resident_set_kb": 9216,
+                "major_page_faults": 3,
+                "minor_page_faults": 1049,
+                "voluntary_context_switches": 1,
+                "involuntary_context_switches": 2,
+                "swaps": 0,
+                "file_system_inputs": 8,
+                "file_system_outputs": 16,
+                "socket_messages_sent": 0,
+                "socket_messages_received": 0,
+                "signals_delivered": 0,
+                "page_size_bytes": 4096,
+                "exit_status": 0,
+            },
+        )
+
+    def test_parse_time_v_output_hours(self):
+        stats = parse_time_v_output(
+            "Command being timed: \"./a.out\"\n"
+            "Elapsed (wall clock) time (h:mm:ss or m:ss): 1:02:03\n"
+        )
+        self.assertEqual(stats["elapsed_time_seconds"], 3723.0)
+
+    def test_image_exists(self):
+        client = MagicMock()
+
+        self.assertTrue(image_exists(client, "python:3.9.19-bullseye"))
+        client.api.inspect_image.assert_called_once_with("python:3.9.19-bullseye")
+
+    def test_image_exists_propagates_api_errors(self):
+        client = MagicMock()
+        client.api.inspect_image.side_effect = docker.errors.ImageNotFound("missing")
+        self.assertFalse(image_exists(client, "missing:latest"))
+
+        client.api.inspect_image.side_effect = docker.errors.APIError("daemon down")
+        with self.assertRaises(docker.errors.APIError):
+            image_exists(client, "broken:latest")
+
+    def test_parse_time_v_output_skips_program_stderr(self):
+        stats = parse_time_v_output("Exit status: 7\nTraceback ...\n" + TIME_V_OUTPUT)
+        self.assertEqual(stats["exit_status"], 0)
+        self.assertEqual(parse_time_v_output("g++: error: code.cpp: No such file"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()